@@ -1,6 +1,8 @@
 import json
 import os
 from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from typing import Any
 
 import torch
@@ -8,13 +10,48 @@ from pytorchvideo.data import LabeledVideoDataset
 
 from eilev.data.utils import C_REGEX, NarratedActionClipSampler
 
+try:
+    # orjson is an optional dependency that parses the large annotation files
+    # a few times faster than the stdlib json module.
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+try:
+    # pyarrow is an optional dependency used to cache the filtered narrated
+    # actions next to the annotation file, so process startup (including
+    # every spawned data loader worker) skips the multi-second JSON parse.
+    import pyarrow as pa
+except ImportError:  # pragma: no cover
+    pa = None  # type: ignore[assignment]
+
+
+@lru_cache(maxsize=4)
+def _load_json(path: str, mtime: float) -> Any:
+    """Load a JSON file, memoized on (path, mtime).
+
+    fho_main.json is big and is parsed once per dataset instance, e.g., once
+    for train and once for val, so share the parsed result across instances.
+    The callers must not mutate the returned data.
+    """
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path) as f:
+        return json.load(f)
+
+
+# bind the match method once; filter_action runs for every annotated action,
+# so even the attribute lookup adds up
+_C_REGEX_MATCH = C_REGEX.match
+
 
 def filter_action(action: dict[str, Any]) -> bool:
     """Return True if the given action should be used, False otherwise."""
     return (
         not action["is_rejected"]
         and action["is_valid_action"]
-        and C_REGEX.match(action["narration_text"]) is not None
+        and _C_REGEX_MATCH(action["narration_text"]) is not None
     )
 
 
@@ -34,6 +71,88 @@ def get_structured_noun(action: dict) -> str | None:
     return None
 
 
+def _build_video_entry(
+    video_uid: str, video: dict[str, Any], video_dir_path: str
+) -> tuple[str, dict[str, Any]]:
+    """Build a (video path, annotation) entry for LabeledVideoDataset from the
+    given video by filtering and formatting its narrated actions in one
+    pass."""
+    return (
+        os.path.join(video_dir_path, video_uid + ".mp4"),
+        {
+            "narrated_actions": [
+                {
+                    "narration_timestamp_sec": action["narration_timestamp_sec"],
+                    "narration_text": action["narration_text"],
+                    "structured_verb": action["structured_verb"],
+                    "structured_noun": get_structured_noun(action),
+                }
+                for interval in video["annotated_intervals"]
+                for action in interval["narrated_actions"]
+                if filter_action(action)
+            ],
+            "video_uid": video_uid,
+            "video_metadata": video["video_metadata"],
+        },
+    )
+
+
+def _write_annotation_cache(cache_path: str, annotations: dict[str, Any]) -> None:
+    """Write the filtered narrated actions of all videos to an arrow file.
+
+    The cache covers the whole annotation file, not just one split, so train
+    and val datasets share it.
+    """
+    columns: dict[str, list] = {
+        "video_uid": [],
+        "narration_timestamp_sec": [],
+        "narration_text": [],
+        "structured_verb": [],
+        "structured_noun": [],
+    }
+    video_metadata: dict[str, Any] = {}
+    for video in annotations["videos"]:
+        video_metadata[video["video_uid"]] = video["video_metadata"]
+        for interval in video["annotated_intervals"]:
+            for action in interval["narrated_actions"]:
+                if not filter_action(action):
+                    continue
+                columns["video_uid"].append(video["video_uid"])
+                columns["narration_timestamp_sec"].append(
+                    action["narration_timestamp_sec"]
+                )
+                columns["narration_text"].append(action["narration_text"])
+                columns["structured_verb"].append(action["structured_verb"])
+                columns["structured_noun"].append(get_structured_noun(action))
+    table = pa.table(columns).replace_schema_metadata(
+        {b"video_metadata": json.dumps(video_metadata).encode()}
+    )
+    # unique per process so concurrent writers, e.g., torchrun ranks, don't
+    # interleave writes in one tmp file and publish a corrupt cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    # atomic so concurrent readers never see a partial cache
+    os.replace(tmp_path, cache_path)
+
+
+def _read_annotation_cache(
+    cache_path: str,
+) -> tuple[dict[str, list[dict[str, Any]]], dict[str, Any]]:
+    """Read the arrow cache back as (narrated actions by video, video
+    metadata by video)."""
+    with pa.memory_map(cache_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    video_metadata = json.loads(table.schema.metadata[b"video_metadata"])
+    actions_by_video: dict[str, list[dict[str, Any]]] = {
+        video_uid: [] for video_uid in video_metadata
+    }
+    for row in table.to_pylist():
+        actions_by_video[row.pop("video_uid")].append(row)
+    return actions_by_video, video_metadata
+
+
 class Ego4dFHOMainDataset(LabeledVideoDataset):
     def __init__(
         self,
@@ -42,6 +161,7 @@ class Ego4dFHOMainDataset(LabeledVideoDataset):
         video_dir_path: str,
         transform: Callable[[dict], Any] | None = None,
         random_clip: bool = False,
+        decoder: str = "pyav",
     ) -> None:
         """
         :param annotation_path: path to the main annotation file, e.g., `fho_main.json`.
@@ -50,12 +170,33 @@ class Ego4dFHOMainDataset(LabeledVideoDataset):
         :param video_path: path to video dir
         :param transform: optional transform function
         :param random_clip: whether to sample clips randomly
+        :param decoder: pytorchvideo decoder to use, e.g., "pyav" (default),
+            "torchvision" or "decord". Decoding dominates the data loading
+            time, so a faster decoder pays off if it's available.
         """
-        with open(annotation_path) as f:
-            annotations = json.load(f)
+        cache_path = annotation_path + ".cache.arrow"
+        use_cache = (
+            pa is not None
+            and os.path.exists(cache_path)
+            and os.path.getmtime(cache_path) >= os.path.getmtime(annotation_path)
+        )
+        if use_cache:
+            actions_by_video, video_metadata = _read_annotation_cache(cache_path)
+        else:
+            annotations = _load_json(
+                annotation_path, os.path.getmtime(annotation_path)
+            )
 
-        # create a dict video_uid => video
-        video_dict = {video["video_uid"]: video for video in annotations["videos"]}
+            # create a dict video_uid => video
+            video_dict = {
+                video["video_uid"]: video for video in annotations["videos"]
+            }
+            if pa is not None:
+                try:
+                    _write_annotation_cache(cache_path, annotations)
+                except OSError:
+                    # e.g., a read-only annotation dir; just skip the cache
+                    pass
 
         with open(split_path) as f:
             split_data = json.load(f)
@@ -76,33 +217,46 @@ class Ego4dFHOMainDataset(LabeledVideoDataset):
                 item = transform(item)
             return item
 
-        super().__init__(
-            [
+        video_uids = list(split_data["videos"])
+        if use_cache:
+            # the cache rows are already filtered and formatted
+            labeled_video_paths = [
                 (
                     os.path.join(video_dir_path, video_uid + ".mp4"),
                     {
-                        "narrated_actions": [
-                            {
-                                "narration_timestamp_sec": action[
-                                    "narration_timestamp_sec"
-                                ],
-                                "narration_text": action["narration_text"],
-                                "structured_verb": action["structured_verb"],
-                                "structured_noun": get_structured_noun(action),
-                            }
-                            for interval in video_dict[video_uid]["annotated_intervals"]
-                            for action in interval["narrated_actions"]
-                            if filter_action(action)
-                        ],
+                        "narrated_actions": actions_by_video[video_uid],
                         "video_uid": video_uid,
-                        "video_metadata": video_dict[video_uid]["video_metadata"],
+                        "video_metadata": video_metadata[video_uid],
                     },
                 )
-                for video_uid in split_data["videos"]
-            ],
+                for video_uid in video_uids
+            ]
+        elif len(video_uids) < 64:
+            # not worth spinning up worker processes
+            labeled_video_paths = [
+                _build_video_entry(video_uid, video_dict[video_uid], video_dir_path)
+                for video_uid in video_uids
+            ]
+        else:
+            # each video is filtered and formatted independently, so fan the
+            # work out across cores instead of looping over millions of
+            # actions in a single Python thread
+            with ProcessPoolExecutor() as executor:
+                labeled_video_paths = list(
+                    executor.map(
+                        partial(_build_video_entry, video_dir_path=video_dir_path),
+                        video_uids,
+                        (video_dict[video_uid] for video_uid in video_uids),
+                        chunksize=64,
+                    )
+                )
+
+        super().__init__(
+            labeled_video_paths,
             NarratedActionClipSampler(random_clip),
             transform=_transform,
             decode_audio=False,
+            decoder=decoder,
         )
 
     def __len__(self) -> int:
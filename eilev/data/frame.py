@@ -1,14 +1,129 @@
 import json
-import random
-from collections import defaultdict
-from collections.abc import Callable
+import os
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from csv import DictReader
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 import torch
-from pytorchvideo.data.video import VideoPathHandler
+from pytorchvideo.data.frame_video import FrameVideo
+from pytorchvideo.data.video import Video, VideoPathHandler
 from torch.utils.data import Dataset
+from torchvision.io import ImageReadMode, read_image
+
+from eilev.data.utils import _make_worker_rng, _stack_pixel_values
+
+_EMPTY_BUCKET = np.empty(0, dtype=np.int64)
+
+_VIDEO_PATH_HANDLER = VideoPathHandler()
+
+
+@lru_cache(maxsize=256)
+def _video_from_path(path: str) -> Video:
+    """Open a video, memoized on its path.
+
+    Opening a video lists and probes its frame directory, so cache the opened
+    videos instead of redoing that work on every access. The cache is
+    per-process, so each data loader worker gets its own.
+    """
+    if os.path.isdir(path):
+        # extracted-frame directories are the common case; build the
+        # FrameVideo directly and skip the handler's per-call file-vs-dir
+        # dispatch, which stats the path twice
+        return FrameVideo.from_directory(
+            path, path_order_cache=_VIDEO_PATH_HANDLER.path_order_cache
+        )
+    return _VIDEO_PATH_HANDLER.video_from_path(path)
+
+
+def _remove_index(bucket: np.ndarray, index: int) -> np.ndarray:
+    """Remove index from a sorted bucket of indices.
+
+    A binary search decides whether the index is present at all, so the
+    common miss case costs O(log n) instead of a full comparison scan and a
+    copy of the bucket.
+    """
+    pos = int(np.searchsorted(bucket, index))
+    if pos < len(bucket) and bucket[pos] == index:
+        return np.delete(bucket, pos)
+    return bucket
+
+
+def _group_indices(values: np.ndarray) -> dict[Any, np.ndarray]:
+    """Group the indices of values by value, vectorized.
+
+    Equivalent to a per-row defaultdict loop, but the grouping runs inside
+    numpy instead of the interpreter. The index arrays are sorted ascending.
+    """
+    uniques, inverse = np.unique(values, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    boundaries = np.cumsum(np.bincount(inverse))[:-1]
+    return dict(zip(uniques.tolist(), np.split(order, boundaries)))
+
+
+def _sample(
+    rng: np.random.Generator, candidates: np.ndarray, drawn: set[int], k: int
+) -> list[int]:
+    """Sample up to k not-yet-drawn indices from candidates without
+    replacement, and mark them as drawn."""
+    if drawn:
+        candidates = candidates[~np.isin(candidates, list(drawn))]
+    if len(candidates) > k:
+        candidates = rng.choice(candidates, size=k, replace=False)
+    sampled = candidates.tolist()
+    drawn.update(sampled)
+    return sampled
+
+
+def _write_column_cache(cache_path: Path, columns: dict[str, np.ndarray]) -> None:
+    """Write the column arrays as a single structured-array .npy file.
+
+    A structured array keeps every column in one file that np.load can
+    memory-map, so data loader workers share the annotation pages through
+    the OS page cache instead of each holding a private copy.
+    """
+    records = np.empty(
+        len(next(iter(columns.values()))) if columns else 0,
+        dtype=[(name, column.dtype) for name, column in columns.items()],
+    )
+    for name, column in columns.items():
+        records[name] = column
+    # unique per process so concurrent writers, e.g., torchrun ranks, don't
+    # interleave writes in one tmp file and publish a corrupt cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, records)
+    # atomic so concurrent readers never see a partial cache
+    os.replace(tmp_path, cache_path)
+
+
+def _read_column_cache(cache_path: Path) -> dict[str, np.ndarray]:
+    """Memory-map the structured-array cache back into per-column views."""
+    records = np.load(cache_path, mmap_mode="r")
+    return {name: records[name] for name in records.dtype.names or ()}
+
+
+class _ColumnarRows(Sequence[dict[str, Any]]):
+    """Read-only row view over per-column arrays.
+
+    Row dicts are materialized lazily on access, so the annotations are held
+    as a few contiguous numpy buffers instead of one Python dict per row.
+    """
+
+    def __init__(self, columns: dict[str, np.ndarray]) -> None:
+        self._columns = columns
+        self._num_rows = len(next(iter(columns.values()))) if columns else 0
+
+    def __len__(self) -> int:
+        return self._num_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._num_rows))]
+        return {name: column[index].item() for name, column in self._columns.items()}
 
 
 class FrameDataset(Dataset[dict[str, Any]]):
@@ -19,6 +134,8 @@ class FrameDataset(Dataset[dict[str, Any]]):
         transform: Callable[[dict[str, Any]], Any] | None = None,
         data_filter: Callable[[dict[str, Any]], bool] | None = None,
         return_frames: bool = True,
+        reuse_frame_buffer: bool = False,
+        columns: Sequence[str] | None = None,
     ) -> None:
         """
         :param frames_dir: path to dir that contains extracted frames.
@@ -27,50 +144,200 @@ class FrameDataset(Dataset[dict[str, Any]]):
         :param annotation_file: path to annotation file. If frames_dir contains
             narrated_actions.csv, this is optional.
         :param transform: transform function to be called for each datapoint
-        :param data_filter: function to be used to filter datapoints
+        :param data_filter: function to be used to filter datapoints.
+            It always sees the full annotation row, regardless of columns.
         :param return_frames: whether to return frame data for each datapoint or not
+        :param reuse_frame_buffer: decode clips into one reusable uint8 buffer
+            per dataset instance instead of allocating a fresh clip tensor on
+            every access. The returned "video" tensor aliases the buffer and
+            is overwritten by the next access, so this is only safe when the
+            transform materializes a new tensor for every item, e.g., by
+            resizing, and the dataset isn't accessed from multiple threads.
+        :param columns: annotation columns to keep; frame_path is always
+            kept. Columns nothing downstream reads are dead strings held in
+            memory and pickled to every data loader worker, so narrowing
+            this to what the transform needs saves both. None (the default)
+            keeps every column.
         """
         self.frames_dir = Path(frames_dir)
         self.return_frames = return_frames
-        self.data: list[dict] = []
-        self.dict_data: dict[str, dict] = {}
+        self._annotation_columns = None if columns is None else tuple(columns)
+        self._reuse_frame_buffer = reuse_frame_buffer
+        self._frame_buffer: torch.Tensor | None = None
         if annotation_file is None:
             self.annotation_file_path = self.frames_dir / "narrated_actions.csv"
         else:
             self.annotation_file_path = Path(annotation_file)
         assert self.annotation_file_path.exists()
-        with open(self.annotation_file_path, newline="") as csvfile:
-            csvreader = DictReader(csvfile)
-            for row in csvreader:
-                if data_filter is not None and not data_filter(row):
-                    continue
-                self.data.append(row)
-                self.dict_data[row["frame_path"]] = row
-
-        self._video_path_handler = VideoPathHandler()
+        # the cache only ever holds the full, unfiltered CSV
+        self._column_cache_path: Path | None = (
+            Path(str(self.annotation_file_path) + ".columns.npy")
+            if data_filter is None
+            else None
+        )
+        if (
+            self._column_cache_path is not None
+            and self._column_cache_path.exists()
+            and os.path.getmtime(self._column_cache_path)
+            >= os.path.getmtime(self.annotation_file_path)
+        ):
+            self._columns = _read_column_cache(self._column_cache_path)
+        else:
+            with open(self.annotation_file_path, newline="") as csvfile:
+                csvreader = DictReader(csvfile)
+                rows = [
+                    row
+                    for row in csvreader
+                    if data_filter is None or data_filter(row)
+                ]
+                fieldnames = csvreader.fieldnames or []
+            # store the annotations columnar: one fixed-width numpy array per
+            # column instead of a Python dict per row. For hundreds of
+            # thousands of narrated actions, per-row dicts bloat RSS and get
+            # copy-on-write faulted in every forked data loader worker, while
+            # the arrays are a few contiguous, refcount-free buffers.
+            self._columns = {
+                name: np.asarray([row[name] for row in rows], dtype=np.str_)
+                for name in fieldnames
+            }
+            if self._column_cache_path is not None:
+                try:
+                    _write_column_cache(self._column_cache_path, self._columns)
+                except OSError:
+                    # e.g., a read-only annotation dir; just skip the cache
+                    self._column_cache_path = None
+        self._select_columns()
+        self._set_columnar_data()
+
         self._transform = transform
 
+    def _select_columns(self) -> None:
+        # the column cache always holds the full CSV; narrowing happens
+        # after loading so datasets with different column needs share it
+        if self._annotation_columns is None:
+            return
+        keep = {"frame_path", *self._annotation_columns}
+        self._columns = {
+            name: column for name, column in self._columns.items() if name in keep
+        }
+
+    def _set_columnar_data(self) -> None:
+        frame_paths = self._columns["frame_path"].tolist() if self._columns else []
+        self._data: Sequence[dict[str, Any]] = _ColumnarRows(self._columns)
+        self._frame_path_index = {
+            frame_path: i for i, frame_path in enumerate(frame_paths)
+        }
+        # resolve frame paths once instead of a per-access os.path.join
+        self._abs_frame_paths = [
+            str(self.frames_dir / frame_path) for frame_path in frame_paths
+        ]
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        # spawned data loader workers allocate their own frame buffer
+        state["_frame_buffer"] = None
+        if self._column_cache_path is None or not isinstance(
+            self._data, _ColumnarRows
+        ):
+            return state
+        # don't serialize the memory-mapped columns to spawned data loader
+        # workers; they re-map the cache file in __setstate__
+        state["_columns"] = None
+        state["_data"] = None
+        state["_frame_path_index"] = None
+        state["_abs_frame_paths"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        if self._columns is None:
+            # __getstate__ only drops the columns when they're cache-backed
+            assert self._column_cache_path is not None
+            self._columns = _read_column_cache(self._column_cache_path)
+            self._select_columns()
+            self._set_columnar_data()
+
+    @property
+    def data(self) -> Sequence[dict[str, Any]]:
+        return self._data
+
+    @data.setter
+    def data(self, data: Sequence[dict[str, Any]]) -> None:
+        # some scripts, e.g., scripts/general/icl_eval.py, filter or augment
+        # the annotations by assigning a plain list of row dicts back
+        self._data = data
+        self._frame_path_index = {row["frame_path"]: i for i, row in enumerate(data)}
+        self._abs_frame_paths = [
+            str(self.frames_dir / row["frame_path"]) for row in data
+        ]
+
     def __getitem__(self, index: int | str) -> dict[str, Any]:
         if isinstance(index, int):
-            datapoint = self.data[index]
+            row_index = index
         else:
-            datapoint = self.dict_data[index]
+            row_index = self._frame_path_index[index]
+        datapoint = self.data[row_index]
         item = {**datapoint}
         if self.return_frames:
-            video = self._video_path_handler.video_from_path(
-                self.frames_dir / datapoint["frame_path"]
-            )
-            # just get the whole video since the clip is already extracted
-            clip = video.get_clip(0, video.duration)
+            video = _video_from_path(self._abs_frame_paths[row_index])
+            if isinstance(video, FrameVideo) and video._video_frame_paths:
+                # read the extracted frames directly as uint8.
+                # FrameVideo.get_clip decodes to float32 only for us to cast
+                # right back, materializing a 4x bigger intermediate.
+                frames = [
+                    read_image(frame_path, ImageReadMode.RGB)
+                    for frame_path in video._video_frame_paths
+                ]
+                if self._reuse_frame_buffer:
+                    # stack into the reusable clip buffer so the big
+                    # (channel, time, height, width) tensor is allocated once
+                    # instead of churning the allocator on every access
+                    shape = (frames[0].size(0), len(frames), *frames[0].shape[1:])
+                    if (
+                        self._frame_buffer is None
+                        or self._frame_buffer.shape != shape
+                    ):
+                        self._frame_buffer = torch.empty(shape, dtype=torch.uint8)
+                    item["video"] = torch.stack(
+                        frames, dim=1, out=self._frame_buffer
+                    )
+                else:
+                    item["video"] = torch.stack(frames, dim=1)
+            else:
+                # just get the whole video since the clip is already extracted
+                clip = video.get_clip(0, video.duration)
 
-            # pytorch video returns pixels as float by default, which causes
-            # problems downstream, so let's convert them to uint8.
-            item["video"] = clip["video"].to(torch.uint8)
+                # pytorch video returns pixels as float by default, which
+                # causes problems downstream, so let's convert them to uint8.
+                item["video"] = clip["video"].to(torch.uint8)
 
         if self._transform is not None:
             item = self._transform(item)
         return item
 
+    @classmethod
+    def collate(cls, batch: list[dict[str, Any]]) -> dict[str, Any]:
+        """Collate function that stacks clip tensors into batch tensors.
+
+        Pass ``collate_fn=FrameDataset.collate`` to the DataLoader. When
+        collating in the main process (num_workers=0) on a CUDA machine,
+        the clips are staged directly into one pinned batch tensor, so
+        ``pin_memory=False`` avoids a redundant second copy and a
+        non-blocking copy to the device overlaps with compute. With
+        workers, collation happens in the worker processes, which must not
+        touch CUDA, so the batch is a plain stack; keep ``pin_memory=True``
+        and let the loader's pin-memory thread pin it. Non-tensor values
+        are collected into lists.
+        """
+        collated: dict[str, Any] = {}
+        for key in batch[0]:
+            values = [item[key] for item in batch]
+            if isinstance(values[0], torch.Tensor):
+                collated[key] = _stack_pixel_values(values)
+            else:
+                collated[key] = values
+        return collated
+
     def __len__(self) -> int:
         return len(self.data)
 
@@ -86,6 +353,7 @@ class FrameInterleavedDataset(Dataset[dict[str, Any]]):
         verb_noun_ratio: float = 0.5,
         transform: Callable[[dict], Any] | None = None,
         return_frames: bool = True,
+        in_context_video_cache_size: int = 0,
     ) -> None:
         """
         :param frames_dir: path to dir that contains extracted frames.
@@ -105,10 +373,17 @@ class FrameInterleavedDataset(Dataset[dict[str, Any]]):
         :param verb_noun_ratio: target verb/noun ratio for in-context examples
         :param transform: transform function to be called for each datapoint
         :param return_frames: whether to return frame data for each datapoint or not
+        :param in_context_video_cache_size: number of decoded in-context clips
+            to keep in a per-worker LRU cache. Examples from popular
+            verb/noun buckets get sampled over and over across datapoints,
+            so a cache skips redecoding them. Only the uint8 clip tensor is
+            cached; don't enable this with a transform that mutates the clip
+            in place. 0 (the default) disables the cache.
         """
         self.num_in_context_examples_per_sample = num_in_context_examples_per_sample
         self.verb_noun_ratio = verb_noun_ratio
         self.return_frames = return_frames
+        self.in_context_video_cache_size = in_context_video_cache_size
         self._dataset = FrameDataset(
             frames_dir=frames_dir,
             annotation_file=annotation_file,
@@ -125,114 +400,221 @@ class FrameInterleavedDataset(Dataset[dict[str, Any]]):
                 return_frames=return_frames,
             )
 
-        # put datapoints into buckets based on their structured verbs and nouns
-        self.structured_verb_buckets: dict[str, set[int]] = defaultdict(set)
-        self.structured_noun_buckets: dict[str, set[int]] = defaultdict(set)
-        for i, datapoint in enumerate(self._in_context_dataset.data):
-            if datapoint["structured_verb"] not in {"", "[other]"}:
-                # NOTE: [other] is a catch-all verb in Ego4D. For these instances,
-                # we just sample from the whole dataset.
-                self.structured_verb_buckets[datapoint["structured_verb"]].add(i)
-            if datapoint["structured_noun"] != "":
-                self.structured_noun_buckets[datapoint["structured_noun"]].add(i)
+        # bucket construction is O(N) and reruns in every non-persistent data
+        # loader worker, so cache the index arrays next to the annotation
+        # file, invalidated by its mtime
+        annotation_file_path = self._in_context_dataset.annotation_file_path
+        bucket_cache_path = (
+            Path(str(annotation_file_path) + ".buckets.npz")
+            if isinstance(annotation_file_path, Path)
+            else None
+        )
+        # per-datapoint verb/noun arrays, so candidate filtering in
+        # __getitem__ is vectorized instead of a Python loop over the buckets
+        self._structured_verbs = np.asarray(
+            [d["structured_verb"] for d in self._in_context_dataset.data], dtype=object
+        )
+        self._structured_nouns = np.asarray(
+            [d["structured_noun"] for d in self._in_context_dataset.data], dtype=object
+        )
+        self.structured_verb_buckets: dict[str, np.ndarray] = {}
+        self.structured_noun_buckets: dict[str, np.ndarray] = {}
+        if (
+            bucket_cache_path is not None
+            and bucket_cache_path.exists()
+            and os.path.getmtime(bucket_cache_path)
+            >= os.path.getmtime(annotation_file_path)
+        ):
+            with np.load(bucket_cache_path) as cached:
+                for key in cached.files:
+                    kind, _, value = key.partition("|")
+                    if kind == "verb":
+                        self.structured_verb_buckets[value] = cached[key]
+                    else:
+                        self.structured_noun_buckets[value] = cached[key]
+        else:
+            # put datapoints into buckets based on their structured verbs
+            # and nouns. The grouping itself runs in numpy, so the per-row
+            # cost is just the verb/noun extraction above.
+            self.structured_verb_buckets = _group_indices(self._structured_verbs)
+            self.structured_verb_buckets.pop("", None)
+            # NOTE: [other] is a catch-all verb in Ego4D. For these
+            # instances, we just sample from the whole dataset.
+            self.structured_verb_buckets.pop("[other]", None)
+            self.structured_noun_buckets = _group_indices(self._structured_nouns)
+            self.structured_noun_buckets.pop("", None)
+            if bucket_cache_path is not None:
+                try:
+                    # unique per process so concurrent writers don't
+                    # interleave writes in one tmp file
+                    tmp_path = f"{bucket_cache_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        np.savez(
+                            f,
+                            **{
+                                f"verb|{verb}": bucket
+                                for verb, bucket in (
+                                    self.structured_verb_buckets.items()
+                                )
+                            },
+                            **{
+                                f"noun|{noun}": bucket
+                                for noun, bucket in (
+                                    self.structured_noun_buckets.items()
+                                )
+                            },
+                        )
+                    os.replace(tmp_path, bucket_cache_path)
+                except OSError:
+                    # e.g., a read-only annotation dir; just skip the cache
+                    pass
+        # seeded lazily per process; see _make_worker_rng
+        self._rng: np.random.Generator | None = None
 
         self._transform = transform
+        # created lazily so each data loader worker gets its own pool
+        self._decode_pool: ThreadPoolExecutor | None = None
+        self._video_cache = self._make_video_cache()
 
-    def __getitem__(self, index: int) -> dict[str, Any]:
-        datapoint = self._dataset[index]
+    def _make_video_cache(self) -> Callable[[int], torch.Tensor] | None:
+        if self.in_context_video_cache_size <= 0:
+            return None
+        return lru_cache(maxsize=self.in_context_video_cache_size)(
+            self._decode_in_context_video
+        )
 
-        verb_bucket: set[int] = set()
-        for i in self.structured_verb_buckets.get(datapoint["structured_verb"], set()):
-            if self.in_context_examples_from_main_dataset and i == index:
-                # filter out the current example if the in-context example
-                # dataset is the same as the main dataset
-                continue
-            if (
-                self._in_context_dataset.data[i]["structured_noun"]
-                == datapoint["structured_noun"]
-            ):
-                # if this in-context example candidate has the same verb and noun
-                # as the current example, skip it.
-                continue
-            verb_bucket.add(i)
-        noun_bucket: set[int] = set()
-        for i in self.structured_noun_buckets.get(datapoint["structured_noun"], set()):
-            if self.in_context_examples_from_main_dataset and i == index:
-                # filter out the current example if the in-context example
-                # dataset is the same as the main dataset
-                continue
-            if (
-                self._in_context_dataset.data[i]["structured_verb"]
-                == datapoint["structured_verb"]
-            ):
-                # if this in-context example candidate has the same verb and noun
-                # as the current example, skip it.
-                continue
-            noun_bucket.add(i)
-
-        def _sample(bucket: set[int], k: int) -> set[int]:
-            if len(bucket) >= k:
-                samples = set(random.sample(bucket, k))
-            else:
-                samples = set(bucket)
-            bucket -= samples
-            return samples
+    def _decode_in_context_video(self, index: int) -> torch.Tensor:
+        return self._in_context_dataset[index]["video"]
+
+    def _get_in_context_item(self, index: int) -> dict[str, Any]:
+        """Fetch an in-context example, serving the clip from the LRU cache
+        when it's enabled."""
+        if self._video_cache is None:
+            return self._in_context_dataset[index]
+        # cache only the clip tensor; the metadata is cheap to rebuild and
+        # would otherwise pin a full item dict per cached clip
+        item = {**self._in_context_dataset.data[index]}
+        if self.return_frames:
+            item["video"] = self._video_cache(index)
+        return item
+
+    def __getstate__(self) -> dict[str, Any]:
+        # thread pools and lru_cache-wrapped bound methods can't be pickled;
+        # spawned data loader workers recreate their own. The rng is dropped
+        # too so every worker derives its own stream
+        state = self.__dict__.copy()
+        state["_decode_pool"] = None
+        state["_video_cache"] = None
+        state["_rng"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._video_cache = self._make_video_cache()
 
-        examples: set[int] = set()
-        num_additional_examples = self.num_in_context_examples_per_sample - len(
-            examples
+    def __getitem__(self, index: int) -> dict[str, Any]:
+        if self._rng is None:
+            self._rng = _make_worker_rng()
+        datapoint = self._dataset.data[index]
+
+        verb_bucket = self.structured_verb_buckets.get(
+            datapoint["structured_verb"], _EMPTY_BUCKET
         )
-        while num_additional_examples > 0 and (
-            len(verb_bucket) > 0 or len(noun_bucket) > 0
-        ):
-            if len(verb_bucket) > 0 and len(noun_bucket) > 0:
-                num_verb_examples = int(num_additional_examples * self.verb_noun_ratio)
-                num_noun_examples = num_additional_examples - num_verb_examples
-            elif len(verb_bucket) == 0:
-                num_verb_examples = 0
-                num_noun_examples = num_additional_examples
-            else:
-                num_noun_examples = 0
-                num_verb_examples = num_additional_examples
+        # filter out candidates with the same verb and noun as the current
+        # example
+        verb_bucket = verb_bucket[
+            self._structured_nouns[verb_bucket] != datapoint["structured_noun"]
+        ]
+        noun_bucket = self.structured_noun_buckets.get(
+            datapoint["structured_noun"], _EMPTY_BUCKET
+        )
+        noun_bucket = noun_bucket[
+            self._structured_verbs[noun_bucket] != datapoint["structured_verb"]
+        ]
+        if self.in_context_examples_from_main_dataset:
+            # filter out the current example if the in-context example
+            # dataset is the same as the main dataset. The buckets are
+            # sorted, so this is a binary search rather than a linear scan.
+            verb_bucket = _remove_index(verb_bucket, index)
+            noun_bucket = _remove_index(noun_bucket, index)
 
-            examples |= _sample(verb_bucket, num_verb_examples)
-            examples |= _sample(noun_bucket, num_noun_examples)
-            num_additional_examples = self.num_in_context_examples_per_sample - len(
-                examples
-            )
+        # the verb and noun buckets are disjoint after the filtering above,
+        # so the (num_verb_examples, num_noun_examples) schedule is fully
+        # determined by the bucket sizes: split per the ratio, then hand any
+        # shortfall in one bucket to the other. This draws exactly what the
+        # old round-by-round loop drew, with one sampling call per bucket.
+        num_verb_candidates = len(verb_bucket)
+        num_noun_candidates = len(noun_bucket)
+        num_examples = self.num_in_context_examples_per_sample
+        if num_verb_candidates > 0 and num_noun_candidates > 0:
+            num_verb_examples = int(num_examples * self.verb_noun_ratio)
+            num_noun_examples = num_examples - num_verb_examples
+            if num_verb_candidates < num_verb_examples:
+                num_noun_examples += num_verb_examples - num_verb_candidates
+                num_verb_examples = num_verb_candidates
+            elif num_noun_candidates < num_noun_examples:
+                num_verb_examples += num_noun_examples - num_noun_candidates
+                num_noun_examples = num_noun_candidates
+        elif num_verb_candidates == 0:
+            num_verb_examples = 0
+            num_noun_examples = num_examples
+        else:
+            num_noun_examples = 0
+            num_verb_examples = num_examples
+
+        examples: list[int] = []
+        # indices drawn so far, so the fallback below doesn't redraw them
+        drawn: set[int] = set()
+        examples.extend(_sample(self._rng, verb_bucket, drawn, num_verb_examples))
+        examples.extend(_sample(self._rng, noun_bucket, drawn, num_noun_examples))
+        num_additional_examples = num_examples - len(examples)
 
         if num_additional_examples > 0:
             # there wasn't enough samples in verb and noun buckets, so sample from the
             # rest of the dataset
-            rest: set[int] = set()
-            for i in range(len(self._in_context_dataset)):
-                if (self.in_context_examples_from_main_dataset and i == index) or (
-                    i in examples
-                ):
-                    # filter out the current example if the in-context example
-                    # dataset is the same as the main dataset or
-                    # it's already been drawn.
-                    continue
-                if (
-                    self._in_context_dataset.data[i]["structured_verb"]
-                    == datapoint["structured_verb"]
-                    and self._in_context_dataset.data[i]["structured_noun"]
-                    == datapoint["structured_noun"]
-                ):
-                    # if this in-context example candidate has the same verb and noun
-                    # as the current example, skip it.
-                    continue
-                rest.add(i)
-            examples |= _sample(rest, num_additional_examples)
+            mask = np.ones(len(self._in_context_dataset), dtype=bool)
+            if drawn:
+                # filter out examples that have already been drawn
+                mask[list(drawn)] = False
+            if self.in_context_examples_from_main_dataset:
+                # filter out the current example if the in-context example
+                # dataset is the same as the main dataset
+                mask[index] = False
+            # filter out candidates with the same verb and noun as the
+            # current example
+            mask &= ~(
+                (self._structured_verbs == datapoint["structured_verb"])
+                & (self._structured_nouns == datapoint["structured_noun"])
+            )
+            examples.extend(
+                _sample(
+                    self._rng, np.flatnonzero(mask), drawn, num_additional_examples
+                )
+            )
 
         # shuffle the in-context examples and append the main datapoint in the end
-        item = {
-            "items": [
-                self._in_context_dataset[i]
-                for i in random.sample(examples, len(examples))
-            ]
-            + [datapoint]
-        }
+        sampled = np.asarray(examples, dtype=np.int64)
+        # in place; permutation() would copy the array just to throw it away
+        self._rng.shuffle(sampled)
+        sampled_indices = sampled.tolist()
+        if self.num_in_context_examples_per_sample > 1:
+            # fetching a datapoint decodes its video frames, which releases
+            # the GIL, so fetch the main datapoint and the in-context
+            # examples in parallel.
+            if self._decode_pool is None:
+                self._decode_pool = ThreadPoolExecutor(
+                    max_workers=self.num_in_context_examples_per_sample + 1
+                )
+            main_future = self._decode_pool.submit(self._dataset.__getitem__, index)
+            in_context_items = list(
+                self._decode_pool.map(self._get_in_context_item, sampled_indices)
+            )
+            item = {"items": in_context_items + [main_future.result()]}
+        else:
+            item = {
+                "items": [self._get_in_context_item(i) for i in sampled_indices]
+                + [self._dataset[index]]
+            }
         if self._transform is not None:
             item = self._transform(item)
         return item
@@ -290,6 +672,14 @@ class FrameInterleavedPresampledDataset(Dataset[dict[str, Any]]):
         with open(in_context_query_map_file_path) as f:
             for line in f:
                 self._in_context_query_map.append(json.loads(line))
+        # seeded lazily per process; see _make_worker_rng
+        self._rng: np.random.Generator | None = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        # spawned data loader workers derive their own rng streams
+        state = self.__dict__.copy()
+        state["_rng"] = None
+        return state
 
     def __getitem__(self, index: int) -> dict[str, Any]:
         in_context_query = self._in_context_query_map[index]
@@ -298,26 +688,19 @@ class FrameInterleavedPresampledDataset(Dataset[dict[str, Any]]):
             for in_context_example in in_context_query["context"]
         ]
         if self.shuffle_in_context_example_frames:
-            video_idx = list(range(len(in_context_examples)))
-            shuffled_video_idx = video_idx[:]
-            while True:
-                # we basically shuffle until no videos are in their original positions
-                # The probability that a random permutation is a derangement is
-                # approximately 1/e no matter how long the list is. As a result,
-                # the expected number of necessary shuffles is about 3, and it rarely
-                # goes over more then ten.
-                # https://stackoverflow.com/questions/15512058/python-shuffle-such-that-position-will-never-repeat/
-                random.shuffle(shuffled_video_idx)
-                for a, b in zip(video_idx, shuffled_video_idx):
-                    if a == b:
-                        break
-                else:
-                    # this else clause is only executed when we exit the for loop
-                    # "normally" without encountering a break statement.
-                    # https://docs.python.org/3/tutorial/controlflow.html#break-and-continue-statements-and-else-clauses-on-loops
-                    # we break out of the while loop here since we've found a
-                    # derangement.
-                    break
+            if self._rng is None:
+                self._rng = _make_worker_rng()
+            num_videos = len(in_context_examples)
+            video_idx = np.arange(num_videos)
+            # we basically shuffle until no videos are in their original positions
+            # The probability that a random permutation is a derangement is
+            # approximately 1/e no matter how long the list is. As a result,
+            # the expected number of necessary shuffles is about 3, and it rarely
+            # goes over more then ten.
+            # https://stackoverflow.com/questions/15512058/python-shuffle-such-that-position-will-never-repeat/
+            shuffled_video_idx = self._rng.permutation(num_videos)
+            while (shuffled_video_idx == video_idx).any():
+                shuffled_video_idx = self._rng.permutation(num_videos)
             shuffled_videos = [
                 in_context_examples[idx]["video"] for idx in shuffled_video_idx
             ]
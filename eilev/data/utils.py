@@ -1,26 +1,111 @@
-import random
 import re
 import string
 from collections.abc import Iterable
+from dataclasses import dataclass
 from fractions import Fraction
 from typing import Any, TypeVar
 
+import numpy as np
 import torch
 from pytorchvideo.data import ClipSampler
 from pytorchvideo.data.clip_sampling import ClipInfo
+from torch.utils.data import get_worker_info
 from transformers import BatchEncoding, DataCollatorForSeq2Seq, PreTrainedTokenizer
 
 C_REGEX = re.compile(r"^\#C\s+C", re.IGNORECASE)
-EOS_REGEX = re.compile(r"\<\|eos\|\>$", re.IGNORECASE)
-UNSURE_END_REGEX = re.compile(r"#unsure\.?$", re.IGNORECASE)
+# "#unsure" and/or "<|eos|>" markers left dangling at the end of a narration
+TRAILING_JUNK_REGEX = re.compile(
+    r"(?:#unsure\.?\s*)?(?:\<\|eos\|\>)?\s*$", re.IGNORECASE
+)
 UNSURE_MIDDLE_REGEX = re.compile(r"#unsure", re.IGNORECASE)
 
 
+def _should_pin() -> bool:
+    """Whether to allocate the batch tensor in pinned memory here.
+
+    Only pin in the main process: pinning initializes CUDA, which crashes
+    forked data loader workers and gives spawned ones a CUDA context each.
+    Batches collated in workers are pinned by the data loader's pin-memory
+    thread instead.
+    """
+    return torch.cuda.is_available() and get_worker_info() is None
+
+
+def _make_worker_rng() -> np.random.Generator:
+    """Create a numpy Generator seeded from torch's per-process seed.
+
+    Call this lazily on first use instead of in __init__: torch seeds every
+    data loader worker differently (and differently across epochs for
+    non-persistent workers), while a generator created in __init__ would be
+    inherited with identical state by every forked worker, making them all
+    draw the same stream.
+    """
+    return np.random.default_rng(torch.initial_seed())
+
+
+def _stack_pixel_values(
+    pixel_values_list: list[torch.Tensor], dtype: torch.dtype | None = None
+) -> torch.Tensor:
+    """Stack per-sample pixel values into a single batch tensor.
+
+    When collating in the main process of a CUDA machine, the batch is
+    allocated in pinned memory so the Trainer's non-blocking host-to-device
+    copy can overlap with compute.
+    If dtype is given, float samples are cast to it as they are copied;
+    uint8 samples are left alone so they can be normalized on the device.
+    """
+    if dtype is None or not pixel_values_list[0].is_floating_point():
+        dtype = pixel_values_list[0].dtype
+    if not _should_pin():
+        return torch.stack(pixel_values_list).to(dtype)
+    batch = torch.empty(
+        (len(pixel_values_list), *pixel_values_list[0].shape),
+        dtype=dtype,
+        pin_memory=True,
+    )
+    for i, pixel_values in enumerate(pixel_values_list):
+        batch[i].copy_(pixel_values)
+    return batch
+
+
+def _cat_pixel_values(
+    pixel_values_list: list[torch.Tensor], dtype: torch.dtype | None = None
+) -> torch.Tensor:
+    """Concatenate per-sample pixel values along the first dimension.
+
+    Like `_stack_pixel_values`, but for samples with a variable number of
+    videos each.
+    """
+    if dtype is None or not pixel_values_list[0].is_floating_point():
+        dtype = pixel_values_list[0].dtype
+    if not _should_pin():
+        return torch.cat(pixel_values_list).to(dtype)
+    batch = torch.empty(
+        (
+            sum(pixel_values.size(0) for pixel_values in pixel_values_list),
+            *pixel_values_list[0].shape[1:],
+        ),
+        dtype=dtype,
+        pin_memory=True,
+    )
+    start = 0
+    for pixel_values in pixel_values_list:
+        batch[start : start + pixel_values.size(0)].copy_(pixel_values)
+        start += pixel_values.size(0)
+    return batch
+
+
+@dataclass
 class DataCollatorForVideoSeq2Seq(DataCollatorForSeq2Seq):
+    # dtype to cast pixel values to, e.g., torch.bfloat16 for a frozen vision
+    # tower under bf16 training, which halves the host-to-device bandwidth
+    pixel_values_dtype: torch.dtype | None = None
+
     def __call__(self, features, return_tensors=None):
         if all("pixel_values" in feature for feature in features):
-            pixel_values = torch.stack(
-                [feature.pop("pixel_values") for feature in features]
+            pixel_values = _stack_pixel_values(
+                [feature.pop("pixel_values") for feature in features],
+                dtype=self.pixel_values_dtype,
             )
         else:
             # in some cases, we don't have pixel values, e.g.,
@@ -32,12 +117,16 @@ class DataCollatorForVideoSeq2Seq(DataCollatorForSeq2Seq):
         return collated
 
 
+@dataclass
 class DataCollatorForInterleavedVideoSeq2Seq(DataCollatorForSeq2Seq):
+    pixel_values_dtype: torch.dtype | None = None
+
     def __call__(self, features, return_tensors=None):
-        pixel_values = torch.cat(
+        pixel_values = _cat_pixel_values(
             [feature.pop("pixel_values") for feature in features]
             if "pixel_values" in features[0].keys()
             else None,
+            dtype=self.pixel_values_dtype,
         )
         video_input_masks = (
             [feature.pop("video_input_mask") for feature in features]
@@ -67,20 +156,14 @@ class DataCollatorForInterleavedVideoSeq2Seq(DataCollatorForSeq2Seq):
 
 
 def clean_narration_text(narration_text: str) -> str:
-    # strip it first
-    cleaned = narration_text.strip()
-
     # replace "#C C" with "The camera wearer"
-    cleaned = re.sub(C_REGEX, "The camera wearer", cleaned).strip()
+    cleaned = C_REGEX.sub("The camera wearer", narration_text.strip()).strip()
 
-    # remove <|eos|>
-    cleaned = re.sub(EOS_REGEX, "", cleaned).strip()
-
-    # remove #unsure from the end
-    cleaned = re.sub(UNSURE_END_REGEX, "", cleaned).strip()
+    # remove trailing "#unsure" and <|eos|> in one pass
+    cleaned = TRAILING_JUNK_REGEX.sub("", cleaned).strip()
 
     # replace #unsure in the middle with "something"
-    cleaned = re.sub(UNSURE_MIDDLE_REGEX, "something", cleaned)
+    cleaned = UNSURE_MIDDLE_REGEX.sub("something", cleaned)
 
     if len(cleaned) == 0:
         return cleaned
@@ -93,7 +176,11 @@ def clean_narration_text(narration_text: str) -> str:
 
 
 def generate_input_ids_and_labels(
-    tokenizer: PreTrainedTokenizer, prompt: str, text: str, decoder_only_lm: bool
+    tokenizer: PreTrainedTokenizer,
+    prompt: str,
+    text: str,
+    decoder_only_lm: bool,
+    prompt_ids: list[int] | None = None,
 ) -> BatchEncoding:
     """Generate input ids and labels from the given prompt and text. If
     decoder_only_lm is True, the input and label texts are the same, but label
@@ -105,11 +192,16 @@ def generate_input_ids_and_labels(
     :param prompt: prompt for the LLM
     :param text: text for the LLM to generate based on the prompt
     :param decoder_only_lm: whether the LLM is decoder only or not
+    :param prompt_ids: optional pre-tokenized prompt. Useful for avoiding
+        repeated tokenization of a fixed prompt, e.g., on the data loading
+        hot path during training.
     :returns: preprocessed results
     """
     if decoder_only_lm:
         # tokenize prompt first
-        prompt_tokens = tokenizer(prompt, return_attention_mask=False).input_ids
+        if prompt_ids is None:
+            prompt_ids = tokenizer(prompt, return_attention_mask=False).input_ids
+        prompt_tokens = prompt_ids
 
         # tokenize the narration and append eos
         preprocessed = tokenizer(
@@ -131,7 +223,10 @@ def generate_input_ids_and_labels(
         # eos is automatically appended by the tokenizer
         # we don't use return_tensors='pt' here b/c it automatically batchifies things
         # which we don't want
-        preprocessed = tokenizer(prompt, return_attention_mask=False)
+        if prompt_ids is None:
+            preprocessed = tokenizer(prompt, return_attention_mask=False)
+        else:
+            preprocessed = BatchEncoding(data={"input_ids": prompt_ids})
         preprocessed["input_ids"] = torch.tensor(preprocessed["input_ids"])
         preprocessed["labels"] = torch.tensor(
             tokenizer(text, return_attention_mask=False).input_ids
@@ -140,6 +235,63 @@ def generate_input_ids_and_labels(
     return preprocessed
 
 
+def generate_input_ids_and_labels_batched(
+    tokenizer: PreTrainedTokenizer,
+    prompt: str,
+    texts: list[str],
+    decoder_only_lm: bool,
+    prompt_ids: list[int] | None = None,
+) -> list[BatchEncoding]:
+    """Batched version of generate_input_ids_and_labels. The prompt is shared
+    across all the texts, and the texts are tokenized in a single call, which
+    lets the fast tokenizer amortize its per-call overhead over the whole
+    batch.
+
+    :param tokenizer: tokenizer for tokenizing inputs and label
+    :param prompt: prompt for the LLM
+    :param texts: texts for the LLM to generate based on the prompt
+    :param decoder_only_lm: whether the LLM is decoder only or not
+    :param prompt_ids: optional pre-tokenized prompt
+    :returns: preprocessed results, one per text
+    """
+    if prompt_ids is None:
+        prompt_ids = tokenizer(prompt, return_attention_mask=False).input_ids
+    if decoder_only_lm:
+        # tokenize the texts and append eos
+        batch_text_ids = tokenizer(
+            [" " + text for text in texts],
+            return_attention_mask=False,
+            add_special_tokens=False,
+        ).input_ids
+        preprocessed_list: list[BatchEncoding] = []
+        for text_ids in batch_text_ids:
+            # join tokenized prompt and text
+            input_ids = torch.tensor(
+                prompt_ids + text_ids + [tokenizer.eos_token_id]
+            )
+
+            # for decoder only LMs, labels are same as input_ids, but we mask
+            # tokens for the prompt
+            labels = input_ids.clone()
+            labels[: len(prompt_ids)] = -100
+            preprocessed_list.append(
+                BatchEncoding(data={"input_ids": input_ids, "labels": labels})
+            )
+        return preprocessed_list
+
+    # eos is automatically appended by the tokenizer
+    batch_label_ids = tokenizer(texts, return_attention_mask=False).input_ids
+    return [
+        BatchEncoding(
+            data={
+                "input_ids": torch.tensor(prompt_ids),
+                "labels": torch.tensor(label_ids),
+            }
+        )
+        for label_ids in batch_label_ids
+    ]
+
+
 def generate_input_ids_and_labels_from_interleaved(
     tokenizer: PreTrainedTokenizer,
     prompts: list[tuple[str, int]],
@@ -251,8 +403,13 @@ class NarratedActionClipSampler(ClipSampler):
         :param random: whether to return random clips or not
         """
         super().__init__(8)
+        # ClipSampler stores the duration as a Fraction; keep a float copy so
+        # __call__ doesn't do arbitrary-precision arithmetic per clip
+        self._clip_duration_sec = float(self._clip_duration)
         self.random = random
-        self.sample_clip_indices: list[int] | None = None
+        # seeded lazily per process; see _make_worker_rng
+        self._rng: np.random.Generator | None = None
+        self.sample_clip_indices: np.ndarray | None = None
 
     def __call__(
         self,
@@ -267,35 +424,39 @@ class NarratedActionClipSampler(ClipSampler):
         :param annotation: narrated action data.
             See https://ego4d-data.org/docs/data/annotations-schemas/ for more details.
         """
-        if self.sample_clip_indices is None:
-            # first time sampling from this video, so create a clip index list
-            self.sample_clip_indices = list(range(len(annotation["narrated_actions"])))
-            if self.random:
-                # shuffle them if random
-                random.shuffle(self.sample_clip_indices)
-
-        clip_index = self.sample_clip_indices[self._current_clip_index]
+        num_clips = len(annotation["narrated_actions"])
+        if self.random:
+            if self.sample_clip_indices is None:
+                if self._rng is None:
+                    self._rng = _make_worker_rng()
+                # first time sampling from this video, so draw a random clip order
+                self.sample_clip_indices = self._rng.permutation(num_clips)
+            clip_index = int(self.sample_clip_indices[self._current_clip_index])
+        else:
+            # when not random, clips are visited in order, so there's no need
+            # to materialize an index list
+            clip_index = self._current_clip_index
         narrated_action = annotation["narrated_actions"][clip_index]
         self._current_clip_index += 1
 
         is_last_clip = False
-        if self._current_clip_index == len(self.sample_clip_indices):
+        if self._current_clip_index == num_clips:
             is_last_clip = True
 
         # sample a clip 8 seconds around narration_time_sec
         # if narration_time_sec is less than 4 seconds, we start from 0
         clip_start_sec = max(
-            Fraction(narrated_action["narration_timestamp_sec"])
-            - self._clip_duration / 2,
-            0,
+            float(narrated_action["narration_timestamp_sec"])
+            - self._clip_duration_sec / 2,
+            0.0,
         )
 
         # add 8 seconds to clip_start_sec
         # if clip_end_sec goes over the video duration, adjust clip_start_sec
-        clip_end_sec = clip_start_sec + self._clip_duration
+        clip_end_sec = clip_start_sec + self._clip_duration_sec
         if clip_end_sec > video_duration:
-            clip_end_sec = video_duration
-            clip_start_sec = clip_end_sec - self._clip_duration
+            clip_end_sec = float(video_duration)
+            clip_start_sec = clip_end_sec - self._clip_duration_sec
 
         if is_last_clip:
             self.reset()
@@ -12,12 +12,15 @@ def process(
     :param video: a tensor of shape (batch, channel, time, height, width) or
         (channel, time, height, width)
     """
+    frames = None
     if video is not None:
         if video.dim() == 4:
             video = video.unsqueeze(0)
         batch, channel, time, _, _ = video.size()
-        video = video.permute(0, 2, 1, 3, 4).flatten(end_dim=1)
-    inputs = processor(images=video, text=text, return_tensors="pt")
+        # hand the image processor a list of (channel, height, width) frame
+        # views instead of materializing a permuted copy of the whole video
+        frames = [frame for clip in video.unbind() for frame in clip.unbind(1)]
+    inputs = processor(images=frames, text=text, return_tensors="pt")
     if video is not None:
         _, _, height, weight = inputs.pixel_values.size()
         inputs["pixel_values"] = inputs.pixel_values.view(
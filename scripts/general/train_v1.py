@@ -5,15 +5,18 @@ from typing import Any
 
 import torch
 import transformers
-from pytorchvideo.transforms import UniformTemporalSubsample
-from torchvision.transforms import Compose
-from transformers.deepspeed import is_deepspeed_zero3_enabled
+from pytorchvideo.transforms.functional import uniform_temporal_subsample
+from torch.utils.data import DataLoader
+from torchvision.transforms import Resize
+from torchvision.transforms.functional import InterpolationMode
+from transformers.integrations.deepspeed import is_deepspeed_zero3_enabled
+from transformers.trainer_utils import seed_worker
 
 from eilev.data.frame import FrameDataset
 from eilev.data.utils import (
     DataCollatorForVideoSeq2Seq,
     clean_narration_text,
-    generate_input_ids_and_labels,
+    generate_input_ids_and_labels_batched,
 )
 from eilev.model.v1 import VideoBlipForConditionalGeneration
 
@@ -21,21 +24,196 @@ PROMPT = "Question: What is the camera wearer doing? Answer:"
 
 
 def preprocess(
-    processor: transformers.Blip2Processor,
     item: dict[str, Any],
-    decoder_only_lm: bool = True,
+    num_subsample_frames: int | None = None,
     video_transform: Callable[[torch.Tensor], torch.Tensor] | None = None,
-) -> dict[str, torch.Tensor]:
-    # tokenize text inputs
-    cleaned_narration_text = clean_narration_text(item["narration_text"])
-    preprocessed = generate_input_ids_and_labels(
-        processor.tokenizer, PROMPT, cleaned_narration_text, decoder_only_lm
-    )
-    preprocessed["pixel_values"] = item["video"]
+) -> dict[str, Any]:
+    pixel_values = item["video"]
+    # pre-extracted clips usually already have num_subsample_frames frames,
+    # in which case the subsample would just be an identity index_select
+    if (
+        num_subsample_frames is not None
+        and pixel_values.size(1) != num_subsample_frames
+    ):
+        pixel_values = uniform_temporal_subsample(pixel_values, num_subsample_frames)
     if video_transform is not None:
-        preprocessed["pixel_values"] = video_transform(preprocessed["pixel_values"])
+        pixel_values = video_transform(pixel_values)
+
+    return {
+        "pixel_values": pixel_values,
+        # tokenization happens in the collator where the narrations for the
+        # whole batch can be tokenized in a single call
+        "cleaned_narration_text": clean_narration_text(item["narration_text"]),
+    }
+
+
+class BatchTokenizingDataCollator(DataCollatorForVideoSeq2Seq):
+    """Data collator that tokenizes all the narrations in the batch with a
+    single tokenizer call before collating them."""
+
+    def __init__(
+        self,
+        *args,
+        prompt_ids: list[int],
+        decoder_only_lm: bool,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.prompt_ids = prompt_ids
+        self.decoder_only_lm = decoder_only_lm
+
+    def __call__(self, features, return_tensors=None):
+        tokenized = generate_input_ids_and_labels_batched(
+            self.tokenizer,
+            PROMPT,
+            [feature.pop("cleaned_narration_text") for feature in features],
+            self.decoder_only_lm,
+            prompt_ids=self.prompt_ids,
+        )
+        for feature, preprocessed in zip(features, tokenized):
+            feature.update(preprocessed)
+        return super().__call__(features, return_tensors=return_tensors)
+
+
+class CudaPrefetcher:
+    """Data loader wrapper that copies the next batch to the device on a side
+    CUDA stream.
+
+    With pinned batches the copies are asynchronous, so the PCIe transfer of
+    the next batch overlaps with the current step's compute instead of
+    stalling the default stream at the start of the forward pass. The wrapped
+    loader must yield CPU batches; see get_train_dataloader, which disables
+    accelerate's own device placement before wrapping.
+    """
+
+    def __init__(self, loader: Any, device: torch.device) -> None:
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream()
+
+    def __getattr__(self, name: str) -> Any:
+        # delegate everything else (dataset, batch_size, set_epoch, ...) to
+        # the wrapped loader so Trainer can treat us as a regular data loader
+        return getattr(self.loader, name)
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __iter__(self):
+        iterator = iter(self.loader)
+        next_batch = self._preload(iterator)
+        while next_batch is not None:
+            batch = next_batch
+            next_batch = self._preload(iterator)
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self.stream)
+            for value in batch.values():
+                if isinstance(value, torch.Tensor):
+                    # keep the caching allocator from reusing the memory
+                    # while the default stream still consumes it
+                    value.record_stream(current_stream)
+            yield batch
+
+    def _preload(self, iterator: Any) -> Any:
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            for key, value in batch.items():
+                if isinstance(value, torch.Tensor):
+                    batch[key] = value.to(self.device, non_blocking=True)
+        return batch
+
+
+class VideoBlipTrainer(transformers.Trainer):
+    """Trainer that normalizes uint8 pixel values on the device.
+
+    Shipping pixel values as uint8 through the data loader workers and the
+    collator cuts the bytes sent between the worker processes and the main
+    process by 4x. The float conversion and normalization are performed here
+    after the batch has been moved to the device.
+    """
 
-    return preprocessed
+    def __init__(
+        self,
+        *args,
+        image_mean: list[float],
+        image_std: list[float],
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        # broadcastable to pixel values of shape (batch, channel, time, height, width)
+        self._image_mean = torch.tensor(image_mean).view(1, 3, 1, 1, 1)
+        self._image_std = torch.tensor(image_std).view(1, 3, 1, 1, 1)
+
+    def _extra_dataloader_params(self) -> dict[str, Any]:
+        """DataLoader knobs TrainingArguments doesn't expose on the pinned
+        transformers: keep workers alive across epochs instead of respawning
+        them, and prefetch more aggressively to keep the pipeline full."""
+        if self.args.dataloader_num_workers == 0:
+            return {}
+        return {"persistent_workers": True, "prefetch_factor": 4}
+
+    def get_train_dataloader(self):
+        if self.train_dataset is None:
+            raise ValueError("Trainer: training requires a train_dataset.")
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            sampler=self._get_train_sampler(),
+            collate_fn=self._get_collator_with_removed_columns(
+                self.data_collator, description="training"
+            ),
+            drop_last=self.args.dataloader_drop_last,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            worker_init_fn=seed_worker,
+            **self._extra_dataloader_params(),
+        )
+        dataloader = self.accelerator.prepare(dataloader)
+        if torch.cuda.is_available():
+            # accelerate's prepared loader moves each batch to the GPU with
+            # a blocking copy on the default stream as the batch is drawn,
+            # which would leave nothing for the prefetcher to overlap. Hand
+            # the batches over still on the CPU so the prefetcher does the
+            # transfer from the collator's pinned memory on its side stream.
+            if getattr(dataloader, "device", None) is not None:
+                dataloader.device = None
+            return CudaPrefetcher(dataloader, self.args.device)
+        return dataloader
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        if eval_dataset is None and self.eval_dataset is None:
+            raise ValueError("Trainer: evaluation requires an eval_dataset.")
+        eval_dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        dataloader = DataLoader(
+            eval_dataset,
+            batch_size=self.args.eval_batch_size,
+            sampler=self._get_eval_sampler(eval_dataset),
+            collate_fn=self._get_collator_with_removed_columns(
+                self.data_collator, description="evaluation"
+            ),
+            drop_last=self.args.dataloader_drop_last,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            **self._extra_dataloader_params(),
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def compute_loss(self, model, inputs, return_outputs=False):
+        pixel_values = inputs.get("pixel_values")
+        if pixel_values is not None and pixel_values.dtype == torch.uint8:
+            if self._image_mean.device != pixel_values.device:
+                self._image_mean = self._image_mean.to(pixel_values.device)
+                self._image_std = self._image_std.to(pixel_values.device)
+            inputs["pixel_values"] = (
+                pixel_values.float()
+                .div_(255)
+                .sub_(self._image_mean)
+                .div_(self._image_std)
+            )
+        return super().compute_loss(model, inputs, return_outputs=return_outputs)
 
 
 # NOTE: We can't use 3.10's new X|Y syntax b/c HfArgumentParser doesn't support it.
@@ -44,6 +222,7 @@ def preprocess(
 class ModelArguments:
     model_name_or_path: str
     num_subsample_frames: int
+    compile_vision_model: bool = field(default=False)
 
 
 @dataclass
@@ -85,41 +264,68 @@ def train() -> None:
     # frozen.
     model.enable_input_require_grads()
 
+    if model_args.compile_vision_model:
+        # the vision model is frozen and always runs at fixed shapes, which
+        # makes it an ideal torch.compile target. The Q-Former and the
+        # language model stay eager to avoid recompilation on
+        # variable-length sequences. Compile the bound forward instead of
+        # rebinding the submodule: reassigning it to the OptimizedModule
+        # wrapper would rename its state_dict keys to
+        # vision_model._orig_mod.*, breaking checkpoints and
+        # from_pretrained on the saved model.
+        model.vision_model.forward = torch.compile(
+            model.vision_model.forward, mode="reduce-overhead", fullgraph=True
+        )
+
+    # the prompt is fixed, so tokenize it once up front instead of once per
+    # sample in the data loader workers
+    prompt_ids = processor.tokenizer(PROMPT, return_attention_mask=False).input_ids
+
+    # Instead of running BlipImageProcessor frame by frame in Python, resize
+    # the whole clip at once with the equivalent torchvision transform. The
+    # clip stays uint8 here; VideoBlipTrainer normalizes it on the device.
+    video_transform = Resize(
+        (
+            processor.image_processor.size["height"],
+            processor.image_processor.size["width"],
+        ),
+        interpolation=InterpolationMode.BICUBIC,
+        antialias=True,
+    )
+
     train_data = FrameDataset(
         data_args.train_narrated_actions_dir,
         transform=partial(
             preprocess,
-            processor,
-            decoder_only_lm=model.config.use_decoder_only_language_model,
-            video_transform=Compose(
-                [UniformTemporalSubsample(model_args.num_subsample_frames)]
-            ),
+            num_subsample_frames=model_args.num_subsample_frames,
+            video_transform=video_transform,
         ),
     )
     val_data = FrameDataset(
         data_args.val_narrated_actions_dir,
         transform=partial(
             preprocess,
-            processor,
-            decoder_only_lm=model.config.use_decoder_only_language_model,
-            video_transform=Compose(
-                [UniformTemporalSubsample(model_args.num_subsample_frames)]
-            ),
+            num_subsample_frames=model_args.num_subsample_frames,
+            video_transform=video_transform,
         ),
     )
 
     # Load the best model at the end so we can save it
     training_args.load_best_model_at_end = True
 
-    trainer = transformers.Trainer(
+    trainer = VideoBlipTrainer(
         model=model,
         args=training_args,
         train_dataset=train_data,
         eval_dataset=val_data,
-        data_collator=DataCollatorForVideoSeq2Seq(
+        data_collator=BatchTokenizingDataCollator(
             processor.tokenizer,
             pad_to_multiple_of=8 if training_args.fp16 or training_args.bf16 else None,
+            prompt_ids=prompt_ids,
+            decoder_only_lm=model.config.use_decoder_only_language_model,
         ),
+        image_mean=processor.image_processor.image_mean,
+        image_std=processor.image_processor.image_std,
     )
     trainer.train(resume_from_checkpoint=training_args.resume_from_checkpoint)
     model.save_pretrained(training_args.output_dir)
@@ -13,10 +13,12 @@ from pytorchvideo.transforms import (
     RandomResizedCrop,
     UniformTemporalSubsample,
 )
+from torch.utils.data import DataLoader
 from torchvision.transforms import Compose, RandomHorizontalFlip, Resize
 from torchvision.transforms.functional import InterpolationMode
 from transformers import PreTrainedTokenizer
 from transformers.integrations.deepspeed import is_deepspeed_zero3_enabled
+from transformers.trainer_utils import seed_worker
 
 from eilev.data.frame import FrameInterleavedDataset
 from eilev.data.utils import (
@@ -48,6 +50,10 @@ class Preprocessor:
     num_query_tokens: int
     decoder_only_lm: bool
     video_transform: Callable[[torch.Tensor], torch.Tensor] | None = None
+    # apply video_transform once over all the videos of a datapoint instead
+    # of once per video. Only valid for transforms whose ops don't care about
+    # extra leading dims, e.g., temporal subsample + resize.
+    batch_video_transform: bool = False
 
     def __call__(self, datapoint: dict[str, Any]) -> dict[str, torch.Tensor]:
         preprocessed = generate_input_ids_and_labels_from_interleaved(
@@ -67,14 +73,107 @@ class Preprocessor:
             self.decoder_only_lm,
         )
         videos = [item["video"] for item in datapoint["items"]]
-        if self.video_transform is not None:
-            for i in range(len(videos)):
-                videos[i] = self.video_transform(videos[i])
-        preprocessed["pixel_values"] = torch.stack(videos)
+        if self.video_transform is None:
+            pixel_values = torch.stack(videos)
+        elif self.batch_video_transform:
+            stacked = torch.stack(videos)
+            num_videos, channel = stacked.size(0), stacked.size(1)
+            # flattening the video and channel dims keeps the input 4D, which
+            # is what the transform ops expect, while still transforming all
+            # the videos in one call
+            pixel_values = self.video_transform(
+                stacked.flatten(end_dim=1)
+            ).unflatten(0, (num_videos, channel))
+        else:
+            pixel_values = torch.stack(
+                [self.video_transform(video) for video in videos]
+            )
+        preprocessed["pixel_values"] = pixel_values
 
         return preprocessed
 
 
+class VideoBlipTrainer(transformers.Trainer):
+    """Trainer that normalizes uint8 pixel values on the device.
+
+    The eval pipeline ships clips as uint8 through the data loader workers,
+    which cuts the bytes sent between the worker processes and the main
+    process by 4x; the float conversion and normalization happen here once
+    the batch is on the device. Training batches arrive already normalized
+    since the augmentations need float, and pass through unchanged.
+    """
+
+    def __init__(
+        self,
+        *args,
+        image_mean: list[float],
+        image_std: list[float],
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        # broadcastable to pixel values of shape (batch, channel, time, height, width)
+        self._image_mean = torch.tensor(image_mean).view(1, 3, 1, 1, 1)
+        self._image_std = torch.tensor(image_std).view(1, 3, 1, 1, 1)
+
+    def _extra_dataloader_params(self) -> dict[str, Any]:
+        """DataLoader knobs TrainingArguments doesn't expose on the pinned
+        transformers: keep workers alive across epochs instead of respawning
+        them, and prefetch more aggressively to keep the pipeline full."""
+        if self.args.dataloader_num_workers == 0:
+            return {}
+        return {"persistent_workers": True, "prefetch_factor": 4}
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.train_dataset is None:
+            raise ValueError("Trainer: training requires a train_dataset.")
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            sampler=self._get_train_sampler(),
+            collate_fn=self._get_collator_with_removed_columns(
+                self.data_collator, description="training"
+            ),
+            drop_last=self.args.dataloader_drop_last,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            worker_init_fn=seed_worker,
+            **self._extra_dataloader_params(),
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def get_eval_dataloader(self, eval_dataset=None) -> DataLoader:
+        if eval_dataset is None and self.eval_dataset is None:
+            raise ValueError("Trainer: evaluation requires an eval_dataset.")
+        eval_dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        dataloader = DataLoader(
+            eval_dataset,
+            batch_size=self.args.eval_batch_size,
+            sampler=self._get_eval_sampler(eval_dataset),
+            collate_fn=self._get_collator_with_removed_columns(
+                self.data_collator, description="evaluation"
+            ),
+            drop_last=self.args.dataloader_drop_last,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            **self._extra_dataloader_params(),
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def compute_loss(self, model, inputs, return_outputs=False):
+        pixel_values = inputs.get("pixel_values")
+        if pixel_values is not None and pixel_values.dtype == torch.uint8:
+            if self._image_mean.device != pixel_values.device:
+                self._image_mean = self._image_mean.to(pixel_values.device)
+                self._image_std = self._image_std.to(pixel_values.device)
+            inputs["pixel_values"] = (
+                pixel_values.float()
+                .div_(255)
+                .sub_(self._image_mean)
+                .div_(self._image_std)
+            )
+        return super().compute_loss(model, inputs, return_outputs=return_outputs)
+
+
 # NOTE: We can't use 3.10's new X|Y syntax b/c HfArgumentParser doesn't support it.
 # https://github.com/huggingface/transformers/issues/20249
 @dataclass
@@ -177,7 +276,9 @@ def train() -> None:
             video_transform=Compose(
                 [
                     UniformTemporalSubsample(model_args.num_subsample_frames),
-                    # Same as BlipImageProcessor from Hugging Face
+                    # Same as BlipImageProcessor from Hugging Face. The clip
+                    # stays uint8 through the data loader workers;
+                    # VideoBlipTrainer normalizes it on the device.
                     Resize(
                         (
                             processor.image_processor.size["height"],
@@ -186,20 +287,16 @@ def train() -> None:
                         interpolation=InterpolationMode.BICUBIC,
                         antialias=True,
                     ),
-                    ConvertUint8ToFloat(),
-                    Normalize(
-                        processor.image_processor.image_mean,
-                        processor.image_processor.image_std,
-                    ),
                 ]
             ),
+            batch_video_transform=True,
         ),
     )
 
     # Load the best model at the end so we can save it
     training_args.load_best_model_at_end = True
 
-    trainer = transformers.Trainer(
+    trainer = VideoBlipTrainer(
         model=model,
         args=training_args,
         train_dataset=train_data,
@@ -207,7 +304,16 @@ def train() -> None:
         data_collator=DataCollatorForInterleavedVideoSeq2Seq(
             processor.tokenizer,
             pad_to_multiple_of=8 if training_args.fp16 or training_args.bf16 else None,
+            # the vision tower is frozen, so feed it half-precision pixel
+            # values directly instead of shipping fp32 to the device
+            pixel_values_dtype=torch.bfloat16
+            if training_args.bf16
+            else torch.float16
+            if training_args.fp16
+            else None,
         ),
+        image_mean=processor.image_processor.image_mean,
+        image_std=processor.image_processor.image_std,
     )
     trainer.train(resume_from_checkpoint=training_args.resume_from_checkpoint)
     model.save_pretrained(training_args.output_dir)
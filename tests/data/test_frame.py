@@ -1,8 +1,21 @@
+import os
+import pickle
 from unittest.mock import Mock, patch
 
+import numpy as np
 import pytest
 
-from eilev.data.frame import FrameInterleavedDataset
+from eilev.data.frame import FrameDataset, FrameInterleavedDataset
+
+
+def _sorted_sample(rng, candidates, drawn, k):
+    """Deterministic stand-in for frame._sample that takes the smallest
+    undrawn indices."""
+    if drawn:
+        candidates = candidates[~np.isin(candidates, list(drawn))]
+    sampled = np.sort(candidates)[:k].tolist()
+    drawn.update(sampled)
+    return sampled
 
 
 @pytest.mark.parametrize(
@@ -547,7 +560,7 @@ from eilev.data.frame import FrameInterleavedDataset
         ),
     ],
 )
-@patch("eilev.data.frame.random.sample", new=lambda p, k: sorted(p)[:k])
+@patch("eilev.data.frame._sample", new=_sorted_sample)
 def test_ego4d_fho_main_frame_interleaved_dataset(data, expected):
     with patch("eilev.data.frame.FrameDataset") as mock_parent_dataset:
         mock_parent_dataset_instance = Mock(data=data)
@@ -557,6 +570,7 @@ def test_ego4d_fho_main_frame_interleaved_dataset(data, expected):
         )
         mock_parent_dataset.return_value = mock_parent_dataset_instance
         dataset = FrameInterleavedDataset("hi")
+        dataset._rng = Mock(shuffle=lambda x: x.sort())
         assert [d for d in dataset] == expected
 
 
@@ -691,7 +705,7 @@ def test_ego4d_fho_main_frame_interleaved_dataset(data, expected):
         ),
     ],
 )
-@patch("eilev.data.frame.random.sample", new=lambda p, k: sorted(p)[:k])
+@patch("eilev.data.frame._sample", new=_sorted_sample)
 def test_ego4d_fho_main_frame_interleaved_dataset_in_context_dataset(
     data, in_context_data, expected
 ):
@@ -721,4 +735,70 @@ def test_ego4d_fho_main_frame_interleaved_dataset_in_context_dataset(
         dataset = FrameInterleavedDataset(
             "data", in_context_example_frames_dir="in-context-data"
         )
+        dataset._rng = Mock(shuffle=lambda x: x.sort())
         assert [d for d in dataset] == expected
+
+
+def test_frame_dataset_column_cache_round_trip(tmp_path):
+    csv_path = tmp_path / "narrated_actions.csv"
+    csv_path.write_text(
+        "frame_path,structured_verb,structured_noun\n"
+        "clip0,verb0,noun0\n"
+        "clip1,verb1,noun1\n"
+    )
+    dataset = FrameDataset(str(tmp_path), return_frames=False)
+    cache_path = tmp_path / "narrated_actions.csv.columns.npy"
+    assert cache_path.exists()
+    rows = list(dataset.data)
+    assert rows == [
+        {
+            "frame_path": "clip0",
+            "structured_verb": "verb0",
+            "structured_noun": "noun0",
+        },
+        {
+            "frame_path": "clip1",
+            "structured_verb": "verb1",
+            "structured_noun": "noun1",
+        },
+    ]
+
+    # a second dataset loads the rows from the cache
+    cached = FrameDataset(str(tmp_path), return_frames=False)
+    assert list(cached.data) == rows
+
+    # the memory-mapped columns are dropped on pickling and re-mapped on
+    # unpickling, as for spawned data loader workers
+    unpickled = pickle.loads(pickle.dumps(cached))
+    assert list(unpickled.data) == rows
+    assert unpickled["clip1"] == rows[1]
+
+
+def test_frame_dataset_stale_column_cache(tmp_path):
+    csv_path = tmp_path / "narrated_actions.csv"
+    csv_path.write_text(
+        "frame_path,structured_verb,structured_noun\nclip0,verb0,noun0\n"
+    )
+    FrameDataset(str(tmp_path), return_frames=False)
+    cache_path = tmp_path / "narrated_actions.csv.columns.npy"
+    assert cache_path.exists()
+
+    # rewrite the CSV with a newer mtime than the cache
+    csv_path.write_text(
+        "frame_path,structured_verb,structured_noun\nclip1,verb1,noun1\n"
+    )
+    os.utime(csv_path, (os.path.getmtime(cache_path) + 1,) * 2)
+
+    dataset = FrameDataset(str(tmp_path), return_frames=False)
+    assert list(dataset.data) == [
+        {
+            "frame_path": "clip1",
+            "structured_verb": "verb1",
+            "structured_noun": "noun1",
+        }
+    ]
+    # subsequent loads see the new rows too, whether they hit the
+    # refreshed cache or reparse
+    assert list(dataset.data) == list(
+        FrameDataset(str(tmp_path), return_frames=False).data
+    )
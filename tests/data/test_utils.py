@@ -1,6 +1,7 @@
 from fractions import Fraction
-from unittest.mock import Mock, patch
+from unittest.mock import Mock
 
+import numpy as np
 import pytest
 import torch
 from pytorchvideo.data.clip_sampling import ClipInfo
@@ -11,6 +12,7 @@ from eilev.data.utils import (
     NarratedActionClipSampler,
     clean_narration_text,
     generate_input_ids_and_labels,
+    generate_input_ids_and_labels_batched,
     generate_input_ids_and_labels_from_interleaved,
     parse_timestamp,
 )
@@ -99,6 +101,116 @@ def test_generate_input_ids_and_labels(
     assert results.labels.equal(expected.labels)
 
 
+@pytest.mark.parametrize(
+    "decoder_only_lm,tokenizer,expected",
+    [
+        (
+            True,
+            Mock(
+                side_effect=[BatchEncoding(data={"input_ids": [4, 3, 2, 1]})],
+                eos_token_id=100,
+            ),
+            BatchEncoding(
+                data={
+                    "input_ids": torch.tensor([1, 2, 3, 4, 4, 3, 2, 1, 100]),
+                    "labels": torch.tensor([-100, -100, -100, -100, 4, 3, 2, 1, 100]),
+                }
+            ),
+        ),
+        (
+            False,
+            Mock(side_effect=[BatchEncoding(data={"input_ids": [4, 3, 2, 1, 100]})]),
+            BatchEncoding(
+                data={
+                    "input_ids": torch.tensor([1, 2, 3, 4]),
+                    "labels": torch.tensor([4, 3, 2, 1, 100]),
+                }
+            ),
+        ),
+    ],
+)
+def test_generate_input_ids_and_labels_pretokenized_prompt(
+    decoder_only_lm: bool, tokenizer, expected: BatchEncoding
+) -> None:
+    results = generate_input_ids_and_labels(
+        tokenizer, "", "", decoder_only_lm, prompt_ids=[1, 2, 3, 4]
+    )
+    # the prompt should not be re-tokenized
+    assert tokenizer.call_count == 1
+    assert results.keys() == expected.keys()
+    assert results.input_ids.equal(expected.input_ids)
+    assert results.labels.equal(expected.labels)
+
+
+@pytest.mark.parametrize(
+    "decoder_only_lm,tokenizer,expected",
+    [
+        (
+            True,
+            Mock(
+                side_effect=[
+                    BatchEncoding(data={"input_ids": [1, 2, 3, 4]}),
+                    BatchEncoding(data={"input_ids": [[4, 3, 2, 1], [5, 6]]}),
+                ],
+                eos_token_id=100,
+            ),
+            [
+                BatchEncoding(
+                    data={
+                        "input_ids": torch.tensor([1, 2, 3, 4, 4, 3, 2, 1, 100]),
+                        "labels": torch.tensor(
+                            [-100, -100, -100, -100, 4, 3, 2, 1, 100]
+                        ),
+                    }
+                ),
+                BatchEncoding(
+                    data={
+                        "input_ids": torch.tensor([1, 2, 3, 4, 5, 6, 100]),
+                        "labels": torch.tensor([-100, -100, -100, -100, 5, 6, 100]),
+                    }
+                ),
+            ],
+        ),
+        (
+            False,
+            Mock(
+                side_effect=[
+                    BatchEncoding(data={"input_ids": [1, 2, 3, 4, 100]}),
+                    BatchEncoding(data={"input_ids": [[4, 3, 2, 1, 100], [5, 6, 100]]}),
+                ]
+            ),
+            [
+                BatchEncoding(
+                    data={
+                        "input_ids": torch.tensor([1, 2, 3, 4, 100]),
+                        "labels": torch.tensor([4, 3, 2, 1, 100]),
+                    }
+                ),
+                BatchEncoding(
+                    data={
+                        "input_ids": torch.tensor([1, 2, 3, 4, 100]),
+                        "labels": torch.tensor([5, 6, 100]),
+                    }
+                ),
+            ],
+        ),
+    ],
+)
+def test_generate_input_ids_and_labels_batched(
+    decoder_only_lm: bool, tokenizer, expected: list[BatchEncoding]
+) -> None:
+    results = generate_input_ids_and_labels_batched(
+        tokenizer, "", ["", ""], decoder_only_lm
+    )
+    # one call for the prompt, one for the whole batch of texts
+    assert tokenizer.call_count == 2
+    assert len(results) == len(expected)
+    for result, expected_item in zip(results, expected):
+        assert result.keys() == expected_item.keys()
+        assert result.input_ids.equal(expected_item.input_ids)
+        assert result.labels.equal(expected_item.labels)
+
+
 @pytest.fixture
 def decoder_only_processor():
     return Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
@@ -875,13 +987,10 @@ def test_parse_timestamps(timestamp, expected):
     assert parse_timestamp(timestamp) == expected
 
 
-def reverse(x: list[int]) -> None:
-    x.reverse()
-
-
-@patch("eilev.data.frame.random.shuffle", new=reverse)
 def test_narrated_action_clip_sampler_random() -> None:
     clip_sampler = NarratedActionClipSampler(True)
+    # "shuffle" deterministically by reversing the clip order
+    clip_sampler._rng = Mock(permutation=lambda n: np.arange(n)[::-1])
     video_duration_1 = 12
     annotation_1 = {
         "narrated_actions": [